@@ -2,6 +2,7 @@ from conan.tools.microsoft import is_msvc
 from conans import ConanFile, CMake, tools
 from conans.errors import ConanInvalidConfiguration
 import functools
+import glob
 import os
 
 
@@ -28,7 +29,9 @@ class OpenVDBConan(ConanFile):
         "with_zlib": [True, False],
         "with_log4cplus": [True, False],
         "with_exr": [True, False],
-        "simd": [None, "SSE42", "AVX"],
+        "simd": [None, "SSE42", "AVX", "AVX2", "AVX512"],
+        "fast_math": [True, False],
+        "march_native": [True, False],
     }
     default_options = {
         "shared": False,
@@ -38,9 +41,11 @@ class OpenVDBConan(ConanFile):
         "with_log4cplus": False,
         "with_exr": False,
         "simd": None,
+        "fast_math": False,
+        "march_native": False,
     }
 
-    generators = "cmake", "cmake_find_package"
+    generators = "cmake", "cmake_find_package_multi"
 
     @property
     def _source_subfolder(self):
@@ -61,6 +66,47 @@ class OpenVDBConan(ConanFile):
             "intel": "17",
         }
 
+    @property
+    def _openvdb_simd(self):
+        if not self.options.simd:
+            return "None"
+        # OpenVDB only knows about SSE42 and AVX, wider instruction sets are enabled on top of AVX
+        simd = str(self.options.simd)
+        return {"AVX2": "AVX", "AVX512": "AVX"}.get(simd, simd)
+
+    @property
+    def _simd_flags(self):
+        if is_msvc(self):
+            return {
+                "AVX": ["/arch:AVX"],
+                "AVX2": ["/arch:AVX2"],
+                "AVX512": ["/arch:AVX512"],
+            }.get(str(self.options.simd), [])
+        return {
+            "AVX2": ["-mavx2", "-mfma"],
+            "AVX512": ["-mavx512f", "-mavx512dq", "-mfma"],
+        }.get(str(self.options.simd), [])
+
+    @property
+    def _fast_math_flags(self):
+        if is_msvc(self):
+            return ["/fp:fast"]
+        # Not -ffast-math: it links crtfastmath.o into the shared library (FTZ/DAZ for the whole
+        # process) and implies -ffinite-math-only, which drops OpenVDB's isNan/isFinite checks
+        return ["-fno-math-errno", "-fno-trapping-math", "-ffp-contract=fast"]
+
+    @property
+    def _march_native_flags(self):
+        if is_msvc(self):
+            # MSVC has no equivalent of -march=native
+            return []
+        if self.settings.os == "Macos" and self.settings.compiler == "apple-clang" and str(self.settings.arch).startswith("armv8"):
+            return ["-mcpu=apple-m1"]
+        if self.settings.arch not in ("x86", "x86_64"):
+            # -march is not accepted by every non-x86 backend (e.g. ppc64le), -mcpu is
+            return ["-mcpu=native"]
+        return ["-march=native", "-mtune=native"]
+
     def export_sources(self):
         self.copy("CMakeLists.txt")
         for patch in self.conan_data.get("patches", {}).get(self.version, []):
@@ -73,13 +119,23 @@ class OpenVDBConan(ConanFile):
     def configure(self):
         if self.options.shared:
             del self.options.fPIC
+        self._strict_options_requirements()
+
+    def _strict_options_requirements(self):
+        self.options["boost"].header_only = False
+        for boost_comp in self._required_boost_components:
+            setattr(self.options["boost"], f"without_{boost_comp}", False)
+
+    @property
+    def _required_boost_components(self):
+        return ["iostreams", "system"]
 
     def requirements(self):
         self.requires("boost/1.79.0")
         self.requires("onetbb/2020.3")
         self.requires("openexr/2.5.7")  # required for IlmBase::Half
         if self.options.with_zlib:
-            self.requires("zlib/1.2.12")
+            self.requires("zlib/1.2.13")
         if self.options.with_exr:
             # Not necessary now. Required for IlmBase::IlmImf
             self.requires("openexr/2.5.7")
@@ -88,6 +144,11 @@ class OpenVDBConan(ConanFile):
         if self.options.with_log4cplus:
             self.requires("log4cplus/2.0.7")
 
+    def build_requirements(self):
+        if not is_msvc(self):
+            # ninja sets CONAN_CMAKE_GENERATOR, MSVC builds keep using the Visual Studio generator
+            self.tool_requires("ninja/1.11.1")
+
     def _check_compilier_version(self):
         compiler = str(self.settings.compiler)
         version = tools.Version(self.settings.compiler.version)
@@ -100,8 +161,15 @@ class OpenVDBConan(ConanFile):
             tools.check_min_cppstd(self, 14)
         if self.settings.arch not in ("x86", "x86_64"):
             if self.options.simd:
-                raise ConanInvalidConfiguration("Only intel architectures support SSE4 or AVX.")
+                raise ConanInvalidConfiguration("Only intel architectures support SSE4, AVX, AVX2 or AVX512.")
+        if self.options.march_native and self.options.simd:
+            raise ConanInvalidConfiguration("march_native and simd options are mutually exclusive.")
+        if self.options.march_native and tools.cross_building(self):
+            raise ConanInvalidConfiguration("march_native targets the build machine and can't be used when cross-building.")
         self._check_compilier_version()
+        miss_boost_required_comp = any(getattr(self.options["boost"], f"without_{boost_comp}", True) for boost_comp in self._required_boost_components)
+        if self.options["boost"].header_only or miss_boost_required_comp:
+            raise ConanInvalidConfiguration(f"{self.name} requires these boost components: {', '.join(self._required_boost_components)}")
 
     def source(self):
         tools.get(**self.conan_data["sources"][self.version], strip_root=True, destination=self._source_subfolder)
@@ -110,20 +178,22 @@ class OpenVDBConan(ConanFile):
         for patch in self.conan_data.get("patches", {}).get(self.version, []):
             tools.patch(**patch)
         # Remove FindXXX files from OpenVDB. Let Conan do the job
-        tools.remove_files_by_mask(os.path.join(self._source_subfolder, "cmake"), "Find*")
-        with open("FindBlosc.cmake", "w") as f:
-            f.write(
-                """find_package(c-blosc)
+        for find_module in glob.glob(os.path.join(self._source_subfolder, "cmake", "Find*")):
+            os.unlink(find_module)
+        if self.options.with_blosc:
+            tools.save(
+                "FindBlosc.cmake",
+                """find_package(c-blosc CONFIG REQUIRED)
 if(c-blosc_FOUND)
     add_library(blosc INTERFACE)
     target_link_libraries(blosc INTERFACE c-blosc::c-blosc)
     add_library(Blosc::blosc ALIAS blosc)
 endif()
-"""
+""",
             )
-        with open("FindIlmBase.cmake", "w") as f:
-            f.write(
-                """find_package(OpenEXR)
+        tools.save(
+            "FindIlmBase.cmake",
+            """find_package(OpenEXR CONFIG)
 if(OpenEXR_FOUND)
   add_library(Half INTERFACE)
   add_library(IlmThread INTERFACE)
@@ -141,8 +211,8 @@ if(OpenEXR_FOUND)
   add_library(IlmBase::Imath ALIAS Imath)
   add_library(OpenEXR::IlmImf ALIAS IlmImf)
  endif()
- """
-            )
+ """,
+        )
 
     def build(self):
         self._patch_sources()
@@ -157,16 +227,25 @@ if(OpenEXR_FOUND)
         cmake.definitions["USE_ZLIB"] = self.options.with_zlib
         cmake.definitions["USE_LOG4CPLUS"] = self.options.with_log4cplus
         cmake.definitions["USE_EXR"] = self.options.with_exr
-        cmake.definitions["OPENVDB_SIMD"] = self.options.simd
+        cmake.definitions["OPENVDB_SIMD"] = self._openvdb_simd
 
         cmake.definitions["OPENVDB_CORE_SHARED"] = self.options.shared
         cmake.definitions["OPENVDB_CORE_STATIC"] = not self.options.shared
 
+        # Static libraries would ship LTO bytecode that consumers can't always link
+        if self.options.shared and self.settings.build_type == "Release":
+            cmake.definitions["CMAKE_INTERPROCEDURAL_OPTIMIZATION"] = True
+
         # All available options but not exposed yet. Set to default values
         cmake.definitions["OPENVDB_BUILD_CORE"] = True
         cmake.definitions["OPENVDB_BUILD_BINARIES"] = False
+        cmake.definitions["OPENVDB_BUILD_VDB_PRINT"] = False
+        cmake.definitions["OPENVDB_BUILD_VDB_LOD"] = False
+        cmake.definitions["OPENVDB_BUILD_VDB_RENDER"] = False
+        cmake.definitions["OPENVDB_BUILD_VDB_VIEW"] = False
         cmake.definitions["OPENVDB_BUILD_PYTHON_MODULE"] = False
         cmake.definitions["OPENVDB_BUILD_UNITTESTS"] = False
+        cmake.definitions["BUILD_TESTING"] = False
         cmake.definitions["OPENVDB_BUILD_DOCS"] = False
         cmake.definitions["OPENVDB_BUILD_HOUDINI_PLUGIN"] = False
         cmake.definitions["OPENVDB_BUILD_HOUDINI_ABITESTS"] = False
@@ -187,7 +266,17 @@ if(OpenEXR_FOUND)
         cmake.definitions["Boost_USE_STATIC_LIBS"] = not self.options["boost"].shared
         cmake.definitions["OPENEXR_USE_STATIC_LIBS"] = not self.options["openexr"].shared
 
-        cmake.definitions["OPENVDB_DISABLE_BOOST_IMPLICIT_LINKING"] = True
+        # Same condition as boost::disable_autolinking in package_info
+        cmake.definitions["OPENVDB_DISABLE_BOOST_IMPLICIT_LINKING"] = self.settings.os == "Windows"
+
+        cxx_flags = self._simd_flags
+        if self.options.fast_math:
+            cxx_flags += self._fast_math_flags
+        if self.options.march_native:
+            cxx_flags += self._march_native_flags
+        if cxx_flags:
+            # Setting CMAKE_CXX_FLAGS prevents CMake from seeding it from CXXFLAGS, keep profile flags
+            cmake.definitions["CMAKE_CXX_FLAGS"] = " ".join([tools.get_env("CXXFLAGS", "")] + cxx_flags).strip()
 
         cmake.configure(build_folder=self._build_subfolder)
         return cmake
@@ -196,6 +285,19 @@ if(OpenEXR_FOUND)
         self.copy("LICENSE", dst="licenses", src=self._source_subfolder)
         cmake = self._configure_cmake()
         cmake.install()
+        if self.options.shared and self.settings.build_type == "Release" and not tools.cross_building(self):
+            self._strip_shared_libraries()
+
+    def _strip_shared_libraries(self):
+        if self.settings.os in ("Linux", "FreeBSD"):
+            pattern, strip_args = "*.so*", "--strip-unneeded"
+        elif self.settings.os == "Macos":
+            pattern, strip_args = "*.dylib", "-x"
+        else:
+            return
+        for lib in glob.glob(os.path.join(self.package_folder, "lib", pattern)):
+            if not os.path.islink(lib):
+                self.run(f"strip {strip_args} \"{lib}\"")
 
     def package_info(self):
         self.cpp_info.set_property("cmake_find_mode", "both")